@@ -7,26 +7,35 @@ from dotenv import load_dotenv
 load_dotenv()
 
 import os
-import json
-import anthropic
-import tools 
+import re
+import time
+import functools
+import threading
+import concurrent.futures
+import orjson
 import tools
 from inspect import signature, getdoc
-from typing import Any
-from elevenlabs.client import ElevenLabs
-
-# Initialize clients
-try:
-    anthropic_client = anthropic.Anthropic(api_key=os.environ['ANTHROPIC_API_KEY'])
-    eleven_client = ElevenLabs(api_key=os.getenv("ELEVENLABS_API_KEY"))
-except KeyError as e:
-    print(f"FATAL: {e} environment variable not set. Please set it to continue.")
-    exit()
+from typing import Any, Iterator
+from cachetools import TTLCache, cached
+from clients import get_anthropic_client
 
 # --- Tool & Prompt Definition ---
 
+def _memoized(func, ttl: float = 30, maxsize: int = 32):
+    """
+    Caches a read-only tool by its keyword arguments for ttl seconds, so the same
+    quote asked for several ways during a negotiation is only computed once.
+    """
+    return cached(
+        TTLCache(maxsize=maxsize, ttl=ttl),
+        key=lambda **kwargs: orjson.dumps(kwargs, option=orjson.OPT_SORT_KEYS),
+        lock=threading.Lock()
+    )(func)
+
+# The static lookups are memoized in tools; only the rate-dependent quote needs a
+# TTL here. record_trade_and_notify books a trade, so it is never cached.
 AVAILABLE_TOOLS = {
-    "get_market_data": tools.get_market_data,
+    "get_market_data": _memoized(tools.get_market_data),
     "check_credit_limit": tools.check_credit_limit,
     "check_trading_risk": tools.check_trading_risk,
     "get_desk_axe": tools.get_desk_axe,
@@ -45,6 +54,7 @@ You MUST use the provided tools to follow this exact workflow:
 5.  **Confirmation:** Provide a clear, final confirmation message including the transaction ID returned by the tool.
 """
 
+@functools.cache
 def create_tool_spec(func) -> dict[str, Any]:
     """Creates a JSON tool specification from a Python function."""
     sig = signature(func)
@@ -68,79 +78,431 @@ def create_tool_spec(func) -> dict[str, Any]:
         }
     }
 
-tools_spec = [create_tool_spec(func) for func in AVAILABLE_TOOLS.values()]
+# The tools and system prompt are identical on every call, so both end in a
+# prompt-cache breakpoint and are billed as cached input after the first turn.
+# The specs are built once and frozen; each request gets a fresh list of them.
+_TOOLS_SPEC_FROZEN = tuple(create_tool_spec(func) for func in AVAILABLE_TOOLS.values())
+_TOOLS_SPEC_FROZEN = _TOOLS_SPEC_FROZEN[:-1] + ({**_TOOLS_SPEC_FROZEN[-1], "cache_control": {"type": "ephemeral"}},)
+SYSTEM_BLOCKS = [{"type": "text", "text": SYSTEM_PROMPT, "cache_control": {"type": "ephemeral"}}]
+
+# The trade under discussion is kept as a few dozen tokens of facts gathered
+# from tool calls, sent to Claude instead of replaying old turns. Each caller
+# owns the dict for its own conversation (a Streamlit session, the API's
+# conversation) and passes it in; None means the turn keeps no state.
+
+# Tool outputs worth remembering, as {tool_name: {output_key: fact_name}}.
+# Every tool's inputs (client, notional, pair, tenor, price, side) are kept as-is.
+TRADE_OUTPUT_FACTS = {
+    "get_market_data": {"all_in_price": "mid_price"},
+}
+
+def _update_trade_context(trade_context: dict, tool_call, output: dict) -> None:
+    """
+    Merges the facts from one tool call into trade_context. A successful
+    booking closes the trade, so the context is cleared for the next one.
+    """
+    if tool_call.name not in AVAILABLE_TOOLS:
+        return
+    if tool_call.name == "record_trade_and_notify" and output.get("status") == "success":
+        trade_context.clear()
+        return
+    trade_context.update(tool_call.input)
+    if output.get("status") == "success":
+        for key, fact in TRADE_OUTPUT_FACTS.get(tool_call.name, {}).items():
+            if key in output:
+                trade_context[fact] = output[key]
+
+def _system_blocks(trade_context: dict | None = None) -> list:
+    """The cached system prompt, followed by the current trade state if there is one."""
+    if not trade_context:
+        return SYSTEM_BLOCKS
+    return SYSTEM_BLOCKS + [{"type": "text", "text": f"<trade_state>{orjson.dumps(trade_context).decode()}</trade_state>"}]
+
+# Number of most recent messages sent to Claude on each call (6 user/assistant pairs).
+MAX_HISTORY = 12
+
+# Once the history grows past SUMMARY_THRESHOLD messages, the oldest
+# SUMMARY_BATCH are folded into a single conversation summary message.
+SUMMARY_THRESHOLD = 20
+SUMMARY_BATCH = 10
+SUMMARY_MODEL = "claude-3-haiku-20240307"
+SUMMARY_PROMPT = "Summarize these turns as bullet facts: client, notional, tenor, quoted price, status."
+
+# Transcript -> summary, so the same evicted turns are never summarized twice.
+_summary_cache: dict[str, str] = {}
+
+def _is_user_text(message: dict) -> bool:
+    """True for a plain user message, i.e. not a tool_result block list."""
+    return message["role"] == "user" and isinstance(message["content"], str)
+
+def _is_summary(message: dict) -> bool:
+    """True for the conversation summary message pinned at the head of the history."""
+    return _is_user_text(message) and message["content"].startswith("<conversation_summary>")
+
+def _windowed(history: list) -> list:
+    """
+    Returns the last MAX_HISTORY messages of the history, plus the pinned
+    conversation summary if there is one.
+    The window is widened back to the nearest plain user message so it never
+    starts on an assistant turn or an orphaned tool_result.
+    process_user_input and stream_user_input start every turn from a single
+    user message, so their window always widens back to it and trims nothing;
+    across turns they rely on trade_context instead. Only a caller that
+    accumulates history, like run_conversation_turn in the demo below, is trimmed.
+    """
+    head = history[:1] if history and _is_summary(history[0]) else []
+    body = history[len(head):]
+    start = max(len(body) - MAX_HISTORY, 0)
+    while start > 0 and not _is_user_text(body[start]):
+        start -= 1
+    return head + body[start:]
+
+def _block_text(block) -> str:
+    """Renders a single content block as a line of plain text."""
+    if isinstance(block, dict):
+        return f"[tool result] {block.get('content', '')}"
+    if block.type == "text":
+        return block.text
+    if block.type == "tool_use":
+        return f"[tool call] {block.name} {orjson.dumps(block.input).decode()}"
+    return ""
+
+def _message_text(message: dict) -> str:
+    """Renders a history message as a single transcript line."""
+    content = message["content"]
+    if not isinstance(content, str):
+        content = " ".join(_block_text(block) for block in content)
+    return f"{message['role']}: {content}"
+
+def _summarize_old_turns(msgs: list) -> str:
+    """Summarizes evicted turns into bullet facts with a cheap Haiku call."""
+    transcript = "\n".join(_message_text(msg) for msg in msgs)
+    if transcript not in _summary_cache:
+        response = get_anthropic_client().messages.create(
+            model=SUMMARY_MODEL,
+            max_tokens=256,
+            system=SUMMARY_PROMPT,
+            messages=[{"role": "user", "content": transcript}]
+        )
+        _summary_cache[transcript] = next(
+            (block.text for block in response.content if block.type == "text"), ""
+        )
+    return _summary_cache[transcript]
+
+def _compact_history(history: list) -> None:
+    """
+    Folds the oldest turns into a conversation summary once the history exceeds
+    SUMMARY_THRESHOLD messages. Any previous summary is part of the evicted
+    turns, so the summary rolls forward.
+    """
+    if len(history) <= SUMMARY_THRESHOLD:
+        return
+
+    # Cut on a plain user message so the remaining history stays well-formed.
+    cut = SUMMARY_BATCH
+    while not _is_user_text(history[cut]):
+        cut += 1
+
+    summary = _summarize_old_turns(history[:cut])
+    print(f"[AGENT] Summarized {cut} old messages")
+    history[:cut] = [{"role": "user", "content": f"<conversation_summary>{summary}</conversation_summary>"}]
+
+# Haiku dispatches tools; a pricing or booking request it answers without
+# calling any tool is retried once on Sonnet.
+FAST_MODEL = "claude-3-haiku-20240307"
+SMART_MODEL = "claude-3-5-sonnet-latest"
+PRICING_KEYWORDS = {"quote", "price", "book"}
+
+def _is_pricing_intent(text: str) -> bool:
+    """True when the user input asks to quote, price or book a trade."""
+    text = text.lower()
+    return any(keyword in text for keyword in PRICING_KEYWORDS)
+
+def _chat_params(history: list, model: str = FAST_MODEL, trade_context: dict | None = None) -> dict[str, Any]:
+    """Builds the request parameters shared by the blocking and streaming calls."""
+    return {
+        "model": model,
+        "max_tokens": 4096,
+        "system": _system_blocks(trade_context),
+        "messages": _windowed(history),
+        "tools": list(_TOOLS_SPEC_FROZEN),
+        "tool_choice": {"type": "auto"}
+    }
+
+def _claude_chat(history: list, model: str = FAST_MODEL, trade_context: dict | None = None):
+    """Sends the windowed history to Claude and returns the response message."""
+    return get_anthropic_client().messages.create(**_chat_params(history, model, trade_context))
 
-def process_user_input(user_input: str) -> str:
+def _dispatch(history: list, trade_context: dict | None = None) -> tuple[Any, str]:
+    """
+    Makes the opening call of a turn on FAST_MODEL and escalates to SMART_MODEL
+    when a pricing request comes back without any tool call.
+    The chosen model is recorded as a MODEL_DISPATCH audit event.
+    Returns the response message and the model the rest of the turn should use.
+    """
+    model = FAST_MODEL
+    message = _claude_chat(history, model, trade_context)
+
+    if message.stop_reason != "tool_use" and _is_pricing_intent(history[-1]['content']):
+        model = SMART_MODEL
+        message = _claude_chat(history, model, trade_context)
+
+    print(f"[AGENT] Model: {model}")
+    tools.log_audit_event("MODEL_DISPATCH", {"model": model, "escalated": model != FAST_MODEL})
+    return message, model
+
+# Greetings and acknowledgements get a canned reply without a Claude round-trip.
+_TRIVIAL = re.compile(r"^\s*(hi|hello|hey|thanks?|thank you|ok(ay)?|got it|cool)\s*[.!?]*\s*$", re.I)
+TRIVIAL_RESPONSE = "Acknowledged."
+
+# Separates the text of consecutive assistant messages in a streamed turn, so the
+# narration before a tool call never runs into the sentence that follows it.
+MESSAGE_SEPARATOR = "\n"
+
+def stream_user_input(user_input: str, trade_context: dict | None = None) -> Iterator[str]:
+    """
+    Process user input and stream the AI response as text deltas.
+    Tool calls are executed between streamed requests, so callers can start
+    speaking the first sentence while Claude is still writing the rest.
+    Every assistant message of the turn is streamed, joined by MESSAGE_SEPARATOR;
+    the generator returns the final message's text, the reply to keep in history.
+    """
+    if _TRIVIAL.match(user_input):
+        yield TRIVIAL_RESPONSE
+        return TRIVIAL_RESPONSE
+
+    history = [{"role": "user", "content": user_input}]
+    print(f"\nUser: {user_input}")
+
+    message = None
+    model = FAST_MODEL
+    wrote_text = False
+    if _is_pricing_intent(user_input):
+        # Pricing turns open with tool dispatch, which has little text to
+        # stream, so that call goes through the model cascade unstreamed.
+        message, model = _dispatch(history, trade_context)
+        history.append({"role": message.role, "content": message.content})
+        for block in message.content:
+            if block.type == "text":
+                wrote_text = True
+                yield block.text
+
+    while message is None or message.stop_reason == "tool_use":
+        if message is not None:
+            tool_calls = [block for block in message.content if block.type == 'tool_use']
+            history.append({"role": "user", "content": _execute_tool_calls(tool_calls, trade_context)})
+
+        with get_anthropic_client().messages.stream(**_chat_params(history, model, trade_context)) as stream:
+            needs_separator = wrote_text
+            for delta in stream.text_stream:
+                if needs_separator:
+                    needs_separator = False
+                    yield MESSAGE_SEPARATOR
+                wrote_text = True
+                yield delta
+            message = stream.get_final_message()
+        history.append({"role": message.role, "content": message.content})
+
+    return _final_text(history)
+
+# A sentence ends at terminal punctuation followed by whitespace, or at a line
+# break. Decimals such as 1.2725 never match, and a match right after a common
+# abbreviation, or one that would leave a fragment shorter than
+# MIN_SENTENCE_LENGTH, is skipped.
+_SENTENCE_BOUNDARY = re.compile(r"(?<=[.!?])\s+|\n\s*")
+_ABBREVIATIONS = ("Dr.", "Mr.", "Mrs.", "Ms.", "AM.", "PM.", "vs.", "e.g.", "i.e.")
+MIN_SENTENCE_LENGTH = 10
+
+class SentenceStream:
+    """
+    Iterates over the AI response one sentence at a time, for callers that
+    synthesize speech per sentence. Sentences keep their trailing whitespace,
+    so joining them gives back the full streamed text, narration before tool
+    calls included. Once iteration ends, final_text holds only the final
+    message's text, which is what belongs in the conversation history.
+    """
+
+    def __init__(self, user_input: str, trade_context: dict | None = None):
+        self.user_input = user_input
+        self.trade_context = trade_context
+        self.final_text = ""
+
+    def _deltas(self) -> Iterator[str]:
+        self.final_text = yield from stream_user_input(self.user_input, self.trade_context)
+
+    def __iter__(self) -> Iterator[str]:
+        buffer = ""
+        for delta in self._deltas():
+            buffer += delta
+            start = 0
+            for match in _SENTENCE_BOUNDARY.finditer(buffer):
+                sentence = buffer[start:match.start()]
+                if sentence.endswith(_ABBREVIATIONS) or len(sentence.strip()) < MIN_SENTENCE_LENGTH:
+                    continue
+                yield buffer[start:match.end()]
+                start = match.end()
+            buffer = buffer[start:]
+
+        if buffer.strip():
+            yield buffer
+
+def stream_sentences(user_input: str, trade_context: dict | None = None) -> SentenceStream:
+    """Process user input and stream the AI response sentence by sentence."""
+    return SentenceStream(user_input, trade_context)
+
+# Offline workloads (backtests, bulk evals) can go through the Message Batches
+# API at half the token price instead of one blocking call per message.
+BATCH_MODE = os.getenv("SYNAPSE_BATCH_MODE", "0") == "1"
+BATCH_MODEL = "claude-3-haiku-20240307"
+BATCH_POLL_INTERVAL = 3.0
+
+def _final_text(history: list) -> str:
+    """Extracts the final text response from a conversation history."""
+    return next(
+        (block.text for block in history[-1]['content'] if hasattr(block, 'text')),
+        "No text response found."
+    )
+
+def process_user_input(user_input: str, trade_context: dict | None = None, use_batch: bool = BATCH_MODE) -> str:
     """
     Process user input and return AI response.
     This is the main entry point for the Streamlit app.
     """
+    if _TRIVIAL.match(user_input):
+        return TRIVIAL_RESPONSE
+
+    if use_batch:
+        return process_user_input_batch([user_input])[0]
+
     conversation_history = [{"role": "user", "content": user_input}]
-    history = run_conversation_turn(conversation_history)
+    history = run_conversation_turn(conversation_history, trade_context)
 
     # Extract the final text response
-    final_response = next(
-        (block.text for block in history[-1]['content'] if hasattr(block, 'text')),
-        "No text response found."
-    )
+    return _final_text(history)
+
+def _run_batch(conversations: dict[str, list]) -> dict[str, Any]:
+    """
+    Submits one request per conversation as a Message Batch, waits for the batch
+    to end and returns the response message for each succeeded custom_id.
+    """
+    # Plain dicts: the SDK's Request and MessageCreateParamsNonStreaming are
+    # TypedDicts, and importing them would load the whole SDK with this module
+    requests = [
+        {
+            "custom_id": custom_id,
+            "params": {
+                "model": BATCH_MODEL,
+                "max_tokens": 1024,
+                # Batch requests share the cached prefix too; trade_state is left out
+                # because batch conversations keep no trade context
+                "system": SYSTEM_BLOCKS,
+                "messages": _windowed(history),
+                "tools": list(_TOOLS_SPEC_FROZEN)
+            }
+        }
+        for custom_id, history in conversations.items()
+    ]
+    batch = get_anthropic_client().messages.batches.create(requests=requests)
+    print(f"[AGENT] Submitted batch {batch.id} with {len(requests)} requests")
 
-    return final_response
+    while batch.processing_status != "ended":
+        time.sleep(BATCH_POLL_INTERVAL)
+        batch = get_anthropic_client().messages.batches.retrieve(batch.id)
 
-def run_conversation_turn(history: list) -> list:
+    responses = {}
+    for entry in get_anthropic_client().messages.batches.results(batch.id):
+        if entry.result.type == "succeeded":
+            responses[entry.custom_id] = entry.result.message
+        else:
+            print(f"[AGENT] Batch request {entry.custom_id} {entry.result.type}")
+    return responses
+
+def process_user_input_batch(messages: list[str]) -> list[str]:
+    """
+    Process many independent user inputs through the Message Batches API.
+    Conversations that stop on tool_use have their tools executed and are
+    resubmitted in a follow-up batch until every one has a final answer.
+    Returns the responses in the same order as the inputs.
+    """
+    histories = {f"q{i}": [{"role": "user", "content": message}] for i, message in enumerate(messages)}
+
+    pending = dict(histories)
+    while pending:
+        responses = _run_batch(pending)
+        next_round = {}
+        for custom_id, history in pending.items():
+            message = responses.get(custom_id)
+            if message is None:
+                continue
+            history.append({"role": message.role, "content": message.content})
+            if message.stop_reason == "tool_use":
+                tool_calls = [block for block in message.content if block.type == 'tool_use']
+                history.append({"role": "user", "content": _execute_tool_calls(tool_calls)})
+                next_round[custom_id] = history
+        pending = next_round
+
+    return [_final_text(histories[f"q{i}"]) for i in range(len(messages))]
+
+def _encode_tool_result(output: dict) -> str:
+    """
+    Serializes a tool output as compact JSON. Tools return numpy scalars read
+    from pandas, which orjson only encodes with OPT_SERIALIZE_NUMPY.
+    """
+    return orjson.dumps(output, option=orjson.OPT_SERIALIZE_NUMPY).decode()
+
+# The pre-trade checks Claude requests together are independent I/O, so the
+# tool calls of one response run concurrently.
+_TOOL_POOL = concurrent.futures.ThreadPoolExecutor(max_workers=8)
+
+def _call_tool(tool_call) -> dict:
+    """Runs a single tool_use block, turning any failure into an error result."""
+    tool_name = tool_call.name
+    tool_input = tool_call.input
+    print(f"[AGENT] Calling Tool: `{tool_name}` with input `{tool_input}`")
+
+    try:
+        if tool_name not in AVAILABLE_TOOLS:
+            raise ValueError(f"Unknown tool '{tool_name}'.")
+        return AVAILABLE_TOOLS[tool_name](**tool_input)
+    except Exception as e:
+        print(f"[AGENT] ERROR calling tool: {e}")
+        return {"status": "error", "message": str(e)}
+
+def _execute_tool_calls(tool_calls: list, trade_context: dict | None = None) -> list:
+    """
+    Executes every tool_use block of a response concurrently and returns one
+    tool_result block per call, in request order, as the API requires for the
+    follow-up request. Given a trade_context, the calls also update it.
+    """
+    tool_outputs = []
+    for tool_call, output in zip(tool_calls, _TOOL_POOL.map(_call_tool, tool_calls)):
+        if trade_context is not None:
+            _update_trade_context(trade_context, tool_call, output)
+        tool_outputs.append({
+            "type": "tool_result",
+            "tool_use_id": tool_call.id,
+            "content": _encode_tool_result(output)
+        })
+    return tool_outputs
+
+def run_conversation_turn(history: list, trade_context: dict | None = None) -> list:
     """Runs one turn of the conversation, including multi-step tool use."""
     print(f"\nUser: {history[-1]['content']}")
+    _compact_history(history)
 
     # Initial call to Claude
-    message = anthropic_client.messages.create(
-        model="claude-3-5-sonnet-20240620",
-        max_tokens=4096,
-        system=SYSTEM_PROMPT,
-        messages=history,
-        tools=tools_spec,
-        tool_choice={"type": "auto"}
-    )
+    message, model = _dispatch(history, trade_context)
     history.append({"role": message.role, "content": message.content})
 
     # This loop handles chains of tool calls
     while message.stop_reason == "tool_use":
         tool_calls = [block for block in message.content if block.type == 'tool_use']
 
-        tool_outputs = []
-        for tool_call in tool_calls:
-            tool_name = tool_call.name
-            tool_input = tool_call.input
-            tool_id = tool_call.id
-            print(f"[AGENT] Calling Tool: `{tool_name}` with input `{tool_input}`")
-
-            if tool_name in AVAILABLE_TOOLS:
-                function_to_call = AVAILABLE_TOOLS[tool_name]
-                try:
-                    output = function_to_call(**tool_input)
-                    tool_outputs.append({
-                        "type": "tool_result",
-                        "tool_use_id": tool_id,
-                        "content": json.dumps(output)
-                    })
-                except Exception as e:
-                    print(f"[AGENT] ERROR calling tool: {e}")
-                    tool_outputs.append({
-                        "type": "tool_result",
-                        "tool_use_id": tool_id,
-                        "content": json.dumps({"status": "error", "message": str(e)})
-                    })
-
         # Append all tool results to the history
-        history.append({"role": "user", "content": tool_outputs})
+        history.append({"role": "user", "content": _execute_tool_calls(tool_calls, trade_context)})
 
         # Make a second call to Claude with the tool results
-        message = anthropic_client.messages.create(
-            model="claude-3-5-sonnet-20240620",
-            max_tokens=4096,
-            system=SYSTEM_PROMPT,
-            messages=history,
-            tools=tools_spec,
-            tool_choice={"type": "auto"}
-        )
+        message = _claude_chat(history, model, trade_context)
         history.append({"role": message.role, "content": message.content})
 
     return history
@@ -150,27 +512,18 @@ if __name__ == "__main__":
     print("--- Starting Synapse Trader Demo ---")
 
     conversation_history = []
+    trade_context = {}
 
     # --- Turn 1: User asks for a quote ---
     user_message_1 = "Can I get a quote on 25 million dollar-sterling for 3 months for ClientCorp?"
     conversation_history.append({"role": "user", "content": user_message_1})
-    conversation_history = run_conversation_turn(conversation_history)
-
-    final_response = next(
-        (block.text for block in conversation_history[-1]['content'] if hasattr(block, 'text')),
-        "No text response found."
-    )
-    print(f"Synapse: {final_response}")
+    conversation_history = run_conversation_turn(conversation_history, trade_context)
+    print(f"Synapse: {_final_text(conversation_history)}")
 
     # --- Turn 2: User books the trade ---
     user_message_2 = "Looks good. Done, book it."
     conversation_history.append({"role": "user", "content": user_message_2})
-    conversation_history = run_conversation_turn(conversation_history)
-
-    final_response = next(
-        (block.text for block in conversation_history[-1]['content'] if hasattr(block, 'text')),
-        "No text response found."
-    )
-    print(f"Synapse: {final_response}")
+    conversation_history = run_conversation_turn(conversation_history, trade_context)
+    print(f"Synapse: {_final_text(conversation_history)}")
 
     print("\n--- Demo Finished ---")
@@ -4,35 +4,67 @@ API Service module for handling audio processing and API calls.
 
 import os
 import io
+import re
 import base64
+import hashlib
+import itertools
 import tempfile
-from typing import Optional, Dict, Any
+from pathlib import Path
+from typing import Dict, Any, Iterator, Optional
 from fastapi import HTTPException
-from elevenlabs.client import ElevenLabs
+from clients import get_eleven_client
+
+# Synthesized speech is cached on disk by content hash; the least recently used
+# files are evicted once the cache holds more than TTS_CACHE_MAX_FILES.
+TTS_CACHE_DIR = Path(os.getenv("TTS_CACHE_DIR", "./audio_outputs/tts_cache"))
+TTS_CACHE_MAX_FILES = int(os.getenv("TTS_CACHE_MAX_FILES", 1000))
+
+# MP3 stays the default because browsers play it everywhere and per-sentence clips
+# concatenate cleanly; 64 kbps is plenty for speech. Callers that control playback
+# can ask for "opus_48000_32", which is smaller still.
+TTS_OUTPUT_FORMAT = os.getenv("ELEVENLABS_OUTPUT_FORMAT", "mp3_44100_64")
+
+# Codec prefix of an ElevenLabs output format -> (file extension, media type)
+AUDIO_FORMATS = {
+    "mp3": ("mp3", "audio/mpeg"),
+    "opus": ("ogg", "audio/ogg"),
+    "pcm": ("pcm", "audio/L16"),
+    "ulaw": ("ulaw", "audio/basic"),
+}
+
+# Cache ids are the sha256 file names the TTS cache writes, and nothing else
+_AUDIO_ID = re.compile(r"^[0-9a-f]{64}\.[a-z0-9]+$")
+
+def audio_format_info(output_format: str) -> tuple[str, str]:
+    """Returns the file extension and media type for an ElevenLabs output format."""
+    codec = output_format.split("_", 1)[0]
+    if codec not in AUDIO_FORMATS:
+        raise HTTPException(status_code=400, detail=f"Unsupported output format: {output_format}")
+    return AUDIO_FORMATS[codec]
 
 class APIService:
     def __init__(self):
-        self.eleven_client = None
+        self.elevenlabs_configured = False
         self.initialize_elevenlabs()
         
         # Constants
         self.DEFAULT_VOICE_ID = os.getenv("ELEVENLABS_VOICE_ID", "JBFqnCBsd6RMkjVDRZzb")
-        self.DEFAULT_MODEL_ID = os.getenv("ELEVENLABS_MODEL_ID", "eleven_multilingual_v2")
+        self.DEFAULT_MODEL_ID = os.getenv("ELEVENLABS_MODEL_ID", "eleven_turbo_v2_5")
         self.STT_MODEL_ID = os.getenv("STT_MODEL_ID", "scribe_v1")
     
     def initialize_elevenlabs(self):
-        """Initialize ElevenLabs client."""
-        try:
-            api_key = os.getenv("ELEVENLABS_API_KEY")
-            if not api_key:
-                print("Warning: ELEVENLABS_API_KEY not found in environment variables")
-                return
-                
-            self.eleven_client = ElevenLabs(api_key=api_key)
-            print("ElevenLabs client initialized successfully")
-        except Exception as e:
-            print(f"Error initializing ElevenLabs client: {e}")
-            self.eleven_client = None
+        """Check the ElevenLabs configuration. The client itself is created on first use."""
+        if not os.getenv("ELEVENLABS_API_KEY"):
+            print("Warning: ELEVENLABS_API_KEY not found in environment variables")
+            return
+            
+        self.elevenlabs_configured = True
+        print("ElevenLabs client configured successfully")
+    
+    @property
+    def eleven_client(self):
+        """The shared ElevenLabs client, or None when no API key is configured."""
+        return get_eleven_client() if self.elevenlabs_configured else None
     
     def process_audio_to_text(self, audio_bytes: bytes) -> str:
         """
@@ -48,39 +80,28 @@ class APIService:
             raise HTTPException(status_code=500, detail="ElevenLabs client not initialized")
         
         try:
-            # Create temporary file
-            with tempfile.NamedTemporaryFile(delete=False, suffix=".wav") as temp_file:
-                temp_file.write(audio_bytes)
-                temp_path = temp_file.name
+            # The SDK accepts any file-like object, so the upload never touches disk
+            audio_file = io.BytesIO(audio_bytes)
+            audio_file.name = "audio.wav"
             
             # Process with ElevenLabs
-            with open(temp_path, "rb") as f:
-                response = self.eleven_client.speech_to_text.convert(
-                    file=f, 
-                    model_id=self.STT_MODEL_ID
-                )
-            
-            # Clean up temp file
-            os.unlink(temp_path)
+            response = self.eleven_client.speech_to_text.convert(
+                file=audio_file, 
+                model_id=self.STT_MODEL_ID
+            )
             
             return response.text
             
         except Exception as e:
-            # Clean up temp file if it exists
-            if 'temp_path' in locals():
-                try:
-                    os.unlink(temp_path)
-                except:
-                    pass
-            
             raise HTTPException(status_code=500, detail=f"Error in speech-to-text: {str(e)}")
     
-    def process_text_to_speech(self, text: str) -> bytes:
+    def process_text_to_speech(self, text: str, output_format: str = TTS_OUTPUT_FORMAT) -> bytes:
         """
         Convert text to speech using ElevenLabs API.
         
         Args:
             text: Text to convert to speech
+            output_format: ElevenLabs output format, e.g. mp3_44100_64
             
         Returns:
             bytes: Audio data
@@ -88,35 +109,159 @@ class APIService:
         if not self.eleven_client:
             raise HTTPException(status_code=500, detail="ElevenLabs client not initialized")
         
+        cache_path = self._tts_cache_path(text, output_format)
+        cached_audio = self._read_tts_cache(cache_path)
+        if cached_audio is not None:
+            return cached_audio
+        
         try:
             # Generate audio
             audio_stream = self.eleven_client.text_to_speech.convert(
                 text=text,
                 voice_id=self.DEFAULT_VOICE_ID,
                 model_id=self.DEFAULT_MODEL_ID,
-                output_format="mp3_44100_128",
+                output_format=output_format,
             )
             
-            # Convert to bytes
-            audio_bytes = b"".join(audio_stream)
-            return audio_bytes
+            # convert() yields the audio in chunks; the cache and the caller need one bytes object
+            audio_buffer = io.BytesIO()
+            for chunk in audio_stream:
+                audio_buffer.write(chunk)
+            audio_bytes = audio_buffer.getvalue()
             
         except Exception as e:
             raise HTTPException(status_code=500, detail=f"Error in text-to-speech: {str(e)}")
+        
+        self._write_tts_cache(cache_path, audio_bytes)
+        return audio_bytes
+    
+    def stream_text_to_speech(self, text: str, output_format: str = TTS_OUTPUT_FORMAT) -> Iterator[bytes]:
+        """
+        Stream text to speech from the ElevenLabs streaming endpoint.
+        Blocks until the first chunk arrives, so request errors still raise here
+        rather than after a streaming response has started.
+        
+        Args:
+            text: Text to convert to speech
+            output_format: ElevenLabs output format, e.g. mp3_44100_64
+            
+        Returns:
+            Iterator[bytes]: Audio chunks in playback order
+        """
+        if not self.eleven_client:
+            raise HTTPException(status_code=500, detail="ElevenLabs client not initialized")
+        
+        cache_path = self._tts_cache_path(text, output_format)
+        cached_audio = self._read_tts_cache(cache_path)
+        if cached_audio is not None:
+            return iter((cached_audio,))
+        
+        try:
+            audio_stream = iter(self.eleven_client.text_to_speech.stream(
+                text=text,
+                voice_id=self.DEFAULT_VOICE_ID,
+                model_id=self.DEFAULT_MODEL_ID,
+                output_format=output_format,
+            ))
+            first_chunk = next(audio_stream, b"")
+            
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"Error in text-to-speech: {str(e)}")
+        
+        return self._cache_while_streaming(cache_path, itertools.chain((first_chunk,), audio_stream))
+    
+    def cache_text_to_speech(self, text: str, output_format: str = TTS_OUTPUT_FORMAT) -> str:
+        """
+        Make sure speech for text is in the TTS cache and return its cache id.
+        The id is served back by cached_audio_path, so responses can link to the
+        audio instead of embedding it.
+        
+        Args:
+            text: Text to convert to speech
+            output_format: ElevenLabs output format, e.g. mp3_44100_64
+            
+        Returns:
+            str: Cache id of the audio file
+        """
+        self.process_text_to_speech(text, output_format)
+        
+        cache_path = self._tts_cache_path(text, output_format)
+        if not cache_path.exists():
+            raise HTTPException(status_code=500, detail="Synthesized audio could not be cached")
+        return cache_path.name
+    
+    def cached_audio_path(self, audio_id: str) -> Optional[Path]:
+        """
+        Resolve a cache id from cache_text_to_speech to its file.
+        
+        Args:
+            audio_id: Cache id of the audio file
+            
+        Returns:
+            Optional[Path]: Path of the cached audio, or None if unknown or evicted
+        """
+        if not _AUDIO_ID.match(audio_id):
+            return None
+        
+        cache_path = TTS_CACHE_DIR / audio_id
+        return cache_path if cache_path.is_file() else None
+    
+    def _tts_cache_path(self, text: str, output_format: str) -> Path:
+        """Cache file for text spoken with the current voice and model in output_format."""
+        extension, _ = audio_format_info(output_format)
+        key = f"{text}|{self.DEFAULT_VOICE_ID}|{self.DEFAULT_MODEL_ID}|{output_format}"
+        return TTS_CACHE_DIR / f"{hashlib.sha256(key.encode()).hexdigest()}.{extension}"
+    
+    def _read_tts_cache(self, path: Path) -> Optional[bytes]:
+        """Return cached audio, marking it recently used, or None on a miss."""
+        try:
+            audio_bytes = path.read_bytes()
+            os.utime(path)
+            return audio_bytes
+        except OSError:
+            return None
+    
+    def _write_tts_cache(self, path: Path, audio_bytes: bytes) -> None:
+        """Store audio atomically, then evict the least recently used files over the limit."""
+        try:
+            TTS_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+            with tempfile.NamedTemporaryFile(dir=TTS_CACHE_DIR, suffix=".tmp", delete=False) as f:
+                f.write(audio_bytes)
+            os.replace(f.name, path)
+            
+            cached_files = sorted(
+                (p for p in TTS_CACHE_DIR.iterdir() if p.suffix != ".tmp"),
+                key=lambda p: p.stat().st_mtime
+            )
+            for stale in cached_files[:-TTS_CACHE_MAX_FILES]:
+                stale.unlink(missing_ok=True)
+        except OSError as e:
+            # A cache failure must never fail the request itself
+            print(f"Error writing TTS cache: {e}")
+    
+    def _cache_while_streaming(self, path: Path, audio_stream: Iterator[bytes]) -> Iterator[bytes]:
+        """Yield chunks unchanged and cache the full audio once the stream completes."""
+        audio_buffer = io.BytesIO()
+        for chunk in audio_stream:
+            audio_buffer.write(chunk)
+            yield chunk
+        self._write_tts_cache(path, audio_buffer.getvalue())
     
-    def create_audio_data_url(self, audio_bytes: bytes) -> str:
+    def create_audio_data_url(self, audio_bytes: bytes, output_format: str = TTS_OUTPUT_FORMAT) -> str:
         """
         Create a data URL for audio bytes.
         
         Args:
             audio_bytes: Raw audio data
+            output_format: ElevenLabs output format the audio was generated in
             
         Returns:
             str: Data URL
         """
         try:
+            _, media_type = audio_format_info(output_format)
             base64_audio = base64.b64encode(audio_bytes).decode('utf-8')
-            return f"data:audio/mpeg;base64,{base64_audio}"
+            return f"data:{media_type};base64,{base64_audio}"
         except Exception as e:
             raise HTTPException(status_code=500, detail=f"Error creating audio data URL: {str(e)}")
     
@@ -147,9 +292,10 @@ class APIService:
             Dict containing health information
         """
         return {
-            "elevenlabs_connected": self.eleven_client is not None,
+            "elevenlabs_connected": self.elevenlabs_configured,
             "voice_id": self.DEFAULT_VOICE_ID,
             "tts_model_id": self.DEFAULT_MODEL_ID,
+            "tts_output_format": TTS_OUTPUT_FORMAT,
             "stt_model_id": self.STT_MODEL_ID,
         }
 
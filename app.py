@@ -3,29 +3,26 @@ Main entry point for the Synapse Trader application.
 Handles UI rendering and orchestrates the workflow between user input and AI responses.
 """
 
-from csv import Error
 import streamlit as st
-from elevenlabs.client import ElevenLabs
 import os
+import concurrent.futures
 from dotenv import load_dotenv
-from agent import process_user_input
+from agent import stream_sentences
+from clients import get_eleven_client
 from streamlit_mic_recorder import mic_recorder
 import io
 
 # Load environment variables
 load_dotenv()
 
-# --- ElevenLabs client initialization ---
-try:
-    eleven_client = ElevenLabs(api_key=os.getenv("ELEVENLABS_API_KEY"))
-except Exception as e:
-    st.error(f"Error initializing ElevenLabs client: {e}")
-    st.stop()
-
 DEFAULT_VOICE_ID = os.getenv("ELEVENLABS_VOICE_ID", "JBFqnCBsd6RMkjVDRZzb")
-DEFAULT_MODEL_ID = os.getenv("ELEVENLABS_MODEL_ID", "eleven_multilingual_v2")
+DEFAULT_MODEL_ID = os.getenv("ELEVENLABS_MODEL_ID", "eleven_turbo_v2_5")
 STT_MODEL_ID = os.getenv("STT_MODEL_ID", "scribe_v1")
 
+# Speech is synthesized off the script thread so the transcript renders while
+# ElevenLabs is still working, and consecutive sentences overlap.
+_TTS_POOL = concurrent.futures.ThreadPoolExecutor(max_workers=2)
+
 def initialize_session_state():
     """Initialize session state variables."""
     if 'conversation_history' not in st.session_state:
@@ -38,36 +35,54 @@ def initialize_session_state():
         st.session_state.last_audio_id = None
     if 'audio_to_play' not in st.session_state:
         st.session_state.audio_to_play = None
-
-def generate_speech(text: str):
-    """Generate TTS via ElevenLabs SDK and store it in session state."""
-    try:
-        audio_stream = eleven_client.text_to_speech.convert(
-            text=text,
-            voice_id=DEFAULT_VOICE_ID,
-            model_id=DEFAULT_MODEL_ID,
-            output_format="mp3_44100_128",
-        )
-        
-        # Convert the audio stream to bytes
-        audio_bytes = b"".join(audio_stream)
-        
-        st.session_state.audio_to_play = audio_bytes
-        
-    except Exception as e:
-        print(e)
-        st.error(f"Error generating audio: {str(e)}")
+    if 'tts_futures' not in st.session_state:
+        st.session_state.tts_futures = []
+    if 'trade_context' not in st.session_state:
+        # The trade under discussion belongs to this browser session only
+        st.session_state.trade_context = {}
+
+@st.cache_data(persist="disk", max_entries=1000, show_spinner=False)
+def _synthesize(text: str) -> bytes:
+    """
+    Synthesize speech via the ElevenLabs streaming endpoint and return the audio bytes.
+    Results persist on disk, so repeated phrases never hit ElevenLabs twice.
+    """
+    audio_stream = get_eleven_client().text_to_speech.stream(
+        text=text,
+        voice_id=DEFAULT_VOICE_ID,
+        model_id=DEFAULT_MODEL_ID,
+        output_format="mp3_44100_64",
+        optimize_streaming_latency=4,
+    )
+    
+    # st.cache_data stores the whole clip, so the streamed chunks are gathered into one buffer
+    audio_buffer = io.BytesIO()
+    for chunk in audio_stream:
+        audio_buffer.write(chunk)
+    return audio_buffer.getvalue()
+
+def generate_speech(text: str) -> concurrent.futures.Future:
+    """Queue TTS generation in the background and return its Future."""
+    return _TTS_POOL.submit(_synthesize, text)
+
+def collect_speech(futures: list) -> list:
+    """Wait for queued TTS generation and return the audio segments that succeeded."""
+    segments = []
+    for future in futures:
+        try:
+            segments.append(future.result())
+        except Exception as e:
+            print(e)
+            st.error(f"Error generating audio: {str(e)}")
+    return segments
 
 def speech_to_text(audio_bytes):
     """Transcribe audio to text using ElevenLabs API."""
     try:
-        audio_path = "audio_inputs/recorded_audio.wav"
-        os.makedirs(os.path.dirname(audio_path), exist_ok=True)
-        with open(audio_path, "wb") as f:
-            f.write(audio_bytes)
+        audio_file = io.BytesIO(audio_bytes)
+        audio_file.name = "recorded_audio.wav"
         
-        with open(audio_path, "rb") as f:
-            response = eleven_client.speech_to_text.convert(file=f, model_id=STT_MODEL_ID)
+        response = get_eleven_client().speech_to_text.convert(file=audio_file, model_id=STT_MODEL_ID)
         
         return response.text
     except Exception as e:
@@ -80,12 +95,18 @@ def process_voice_input(audio_bytes):
     if transcribed_text:
         st.session_state.conversation_history.append({"role": "user", "content": transcribed_text})
         
+        # Each sentence is synthesized as soon as Claude finishes it, so speech
+        # generation overlaps with the rest of the response being written.
+        # Every sentence is spoken, but only the final answer goes into the history.
+        sentences = stream_sentences(transcribed_text, st.session_state.trade_context)
+        tts_futures = []
         with st.spinner("Processing your query..."):
-            response = process_user_input(transcribed_text)
+            for sentence in sentences:
+                tts_futures.append(generate_speech(sentence.strip()))
         
-        st.session_state.conversation_history.append({"role": "assistant", "content": response})
+        st.session_state.conversation_history.append({"role": "assistant", "content": sentences.final_text})
         
-        generate_speech(response)
+        st.session_state.tts_futures = tts_futures
         st.rerun()
 
 def main():
@@ -102,10 +123,6 @@ def main():
 
     initialize_session_state()
 
-    if st.session_state.audio_to_play:
-        audio_placeholder.audio(st.session_state.audio_to_play, autoplay=True)
-        st.session_state.audio_to_play = None
-
     # Display conversation history
     st.subheader("Conversation History")
     for message in st.session_state.conversation_history:
@@ -125,9 +142,20 @@ def main():
 
         if st.button("End Conversation"):
             st.session_state.conversation_active = False
+            st.session_state.trade_context = {}
             st.rerun()
 
+    # Resolve background speech only after the rest of the page has rendered
+    if st.session_state.tts_futures:
+        with st.status("Generating audio...") as status:
+            st.session_state.audio_to_play = collect_speech(st.session_state.tts_futures)
+            status.update(label="Audio ready", state="complete")
+        st.session_state.tts_futures = []
+
+    if st.session_state.audio_to_play:
+        # MP3 frames concatenate cleanly, so the segments play back in sequence.
+        audio_placeholder.audio(b"".join(st.session_state.audio_to_play), autoplay=True)
+        st.session_state.audio_to_play = None
+
 if __name__ == "__main__":
-    os.makedirs("audio_inputs", exist_ok=True)
-    os.makedirs("audio_outputs", exist_ok=True)
     main()
@@ -0,0 +1,63 @@
+"""
+Shared API clients for Synapse Trader.
+Every module gets its Anthropic and ElevenLabs client from here, so the
+whole process reuses one connection pool per provider. Clients are created
+on first use, and each SDK is only imported then, so importing a module never
+requires every API key or pays for an SDK it does not call.
+"""
+
+from dotenv import load_dotenv
+load_dotenv()
+
+import os
+import functools
+import httpx
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    import anthropic
+    from elevenlabs.client import ElevenLabs
+
+# HTTP/2 keep-alive pools, shared by every call site in the process. Sized for
+# concurrent API requests, so a burst never waits on a free connection.
+HTTP_LIMITS = httpx.Limits(max_connections=50, max_keepalive_connections=50, keepalive_expiry=30)
+
+# Fail fast on an unreachable host; reads allow for long non-streaming completions
+ANTHROPIC_TIMEOUT = httpx.Timeout(120.0, connect=5.0)
+
+# ElevenLabs only applies its default timeout when it builds its own httpx client
+ELEVENLABS_TIMEOUT = 240
+
+@functools.lru_cache(maxsize=1)
+def get_anthropic_client() -> "anthropic.Anthropic":
+    """Returns the shared Anthropic client, creating it on first use."""
+    import anthropic
+
+    api_key = os.getenv("ANTHROPIC_API_KEY")
+    if not api_key:
+        raise RuntimeError("ANTHROPIC_API_KEY environment variable not set. Please set it to continue.")
+
+    return anthropic.Anthropic(
+        api_key=api_key,
+        timeout=ANTHROPIC_TIMEOUT,
+        http_client=anthropic.DefaultHttpxClient(http2=True, limits=HTTP_LIMITS, timeout=ANTHROPIC_TIMEOUT)
+    )
+
+@functools.lru_cache(maxsize=1)
+def get_eleven_client() -> "ElevenLabs":
+    """Returns the shared ElevenLabs client, creating it on first use."""
+    from elevenlabs.client import ElevenLabs
+
+    api_key = os.getenv("ELEVENLABS_API_KEY")
+    if not api_key:
+        raise RuntimeError("ELEVENLABS_API_KEY environment variable not set. Please set it to continue.")
+
+    return ElevenLabs(
+        api_key=api_key,
+        timeout=ELEVENLABS_TIMEOUT,
+        httpx_client=httpx.Client(
+            http2=True,
+            limits=HTTP_LIMITS,
+            timeout=httpx.Timeout(ELEVENLABS_TIMEOUT, connect=5.0)
+        )
+    )
@@ -3,32 +3,76 @@ FastAPI backend for Synapse Trader application.
 Handles API endpoints for chat, speech-to-text, and text-to-speech.
 """
 
-from fastapi import FastAPI, HTTPException, UploadFile, File, Form
+from fastapi import FastAPI, HTTPException, UploadFile, File, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import StreamingResponse
+from fastapi.responses import FileResponse, ORJSONResponse, StreamingResponse
+from starlette.concurrency import run_in_threadpool
 from pydantic import BaseModel
 from typing import List, Optional
+from collections import deque
+from contextlib import asynccontextmanager
 import os
-import io
-import json
+import itertools
+import anyio
 from datetime import datetime
 from dotenv import load_dotenv
 
 # Import existing modules
-from agent import process_user_input
-from api_service import api_service
+from agent import process_user_input, stream_sentences
+from api_service import api_service, audio_format_info, AUDIO_FORMATS, TTS_OUTPUT_FORMAT
+from tools import flush_audit_log
 
 # Load environment variables
 load_dotenv()
 
+# Threads shared by run_in_threadpool, sync endpoints and streamed responses, all of
+# which go through anyio's default limiter; each LLM/TTS call holds one for seconds
+THREADPOOL_SIZE = int(os.getenv("THREADPOOL_SIZE", 100))
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    On startup, raise anyio's default thread limit so concurrent requests do
+    not queue behind each other. On shutdown, write out audit events still
+    queued for the writer thread.
+    """
+    anyio.to_thread.current_default_thread_limiter().total_tokens = THREADPOOL_SIZE
+    yield
+    flush_audit_log()
+
 # Initialize FastAPI app
 app = FastAPI(
     title="Synapse Trader API",
     description="AI-powered trading assistant API",
-    version="1.0.0"
+    version="1.0.0",
+    default_response_class=ORJSONResponse,
+    lifespan=lifespan
 )
 
-# Add CORS middleware
+# Largest audio file accepted by the upload endpoints
+MAX_AUDIO_BYTES = int(os.getenv("MAX_AUDIO_MB", 10)) * 1024 * 1024
+# Room for the multipart boundaries and part headers around the file itself
+MULTIPART_OVERHEAD = 16 * 1024
+AUDIO_UPLOAD_PATHS = ("/api/speech-to-text", "/api/audio-chat")
+AUDIO_CONTENT_TYPES = ("audio/", "video/webm", "application/octet-stream")
+
+@app.middleware("http")
+async def reject_oversized_uploads(request: Request, call_next):
+    """
+    Refuse an audio upload whose declared Content-Length is over the limit.
+    This runs before the multipart form is parsed, so the body is never received;
+    by the time an endpoint runs, Starlette has already spooled the whole upload.
+    """
+    if request.url.path in AUDIO_UPLOAD_PATHS:
+        content_length = request.headers.get("content-length", "")
+        if content_length.isdigit() and int(content_length) > MAX_AUDIO_BYTES + MULTIPART_OVERHEAD:
+            return ORJSONResponse(
+                status_code=413,
+                content={"detail": f"Audio file too large. Maximum size: {MAX_AUDIO_BYTES} bytes"}
+            )
+    return await call_next(request)
+
+# Add CORS middleware last so it wraps every response, including the 413 above
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["http://localhost:3000", "http://127.0.0.1:3000"],
@@ -50,6 +94,7 @@ class SpeechToTextResponse(BaseModel):
 
 class TextToSpeechRequest(BaseModel):
     text: str
+    output_format: str = TTS_OUTPUT_FORMAT
 
 class Message(BaseModel):
     role: str
@@ -59,8 +104,49 @@ class Message(BaseModel):
 class ConversationHistoryResponse(BaseModel):
     messages: List[Message]
 
-# In-memory conversation storage (replace with database in production)
-conversation_history = []
+# In-memory conversation storage (replace with database in production).
+# Only the most recent MAX_HISTORY messages are kept, so a long session has bounded memory.
+conversation_history: deque = deque(maxlen=int(os.getenv("MAX_HISTORY", 200)))
+
+# The trade under discussion in that conversation, updated by the agent's tool calls
+trade_context: dict = {}
+
+def record_message(role: str, content: str) -> None:
+    """Append a message to the conversation history, evicting the oldest when full."""
+    conversation_history.append(Message(
+        role=role,
+        content=content,
+        timestamp=datetime.now().isoformat()
+    ))
+
+async def read_audio_upload(audio: UploadFile) -> bytes:
+    """
+    Read an audio upload, rejecting non-audio content types and oversized files.
+    Oversized requests that declare a Content-Length are refused earlier by
+    reject_oversized_uploads; uploads without one are checked here, after
+    Starlette has spooled them.
+    """
+    if audio.content_type and not audio.content_type.startswith(AUDIO_CONTENT_TYPES):
+        raise HTTPException(status_code=415, detail=f"Unsupported audio type: {audio.content_type}")
+    
+    if audio.size is not None and audio.size > MAX_AUDIO_BYTES:
+        raise HTTPException(status_code=413, detail=f"Audio file too large. Maximum size: {MAX_AUDIO_BYTES} bytes")
+    
+    audio_bytes = await audio.read()
+    api_service.validate_audio_file(audio_bytes, max_size=MAX_AUDIO_BYTES)
+    return audio_bytes
+
+async def speech_url(http_request: Request, text: str) -> Optional[str]:
+    """
+    Synthesize text into the TTS cache and return an absolute URL to fetch it from.
+    The chat JSON stays small and the browser downloads the audio separately.
+    """
+    try:
+        audio_id = await run_in_threadpool(api_service.cache_text_to_speech, text)
+        return str(http_request.url_for("get_audio", audio_id=audio_id))
+    except Exception as e:
+        print(f"Error generating audio: {e}")
+        return None
 
 @app.get("/")
 async def root():
@@ -73,37 +159,23 @@ async def root():
     }
 
 @app.post("/api/chat", response_model=ChatResponse)
-async def chat_endpoint(request: ChatRequest):
+async def chat_endpoint(request: ChatRequest, http_request: Request):
     """
     Process text message and return AI response.
+    The agent and TTS calls block, so they run in worker threads to keep the event loop free.
     """
     try:
         # Add user message to history
-        user_message = {
-            "role": "user",
-            "content": request.text,
-            "timestamp": datetime.now().isoformat()
-        }
-        conversation_history.append(user_message)
+        record_message("user", request.text)
         
         # Process with AI agent
-        response_text = process_user_input(request.text)
+        response_text = await run_in_threadpool(process_user_input, request.text, trade_context)
         
         # Add assistant message to history
-        assistant_message = {
-            "role": "assistant",
-            "content": response_text,
-            "timestamp": datetime.now().isoformat()
-        }
-        conversation_history.append(assistant_message)
+        record_message("assistant", response_text)
         
         # Generate audio response
-        audio_url = None
-        try:
-            audio_bytes = api_service.process_text_to_speech(response_text)
-            audio_url = api_service.create_audio_data_url(audio_bytes)
-        except Exception as e:
-            print(f"Error generating audio: {e}")
+        audio_url = await speech_url(http_request, response_text)
         
         return ChatResponse(
             text=response_text,
@@ -113,23 +185,59 @@ async def chat_endpoint(request: ChatRequest):
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error processing chat: {str(e)}")
 
+@app.post("/api/chat-stream")
+async def chat_stream_endpoint(request: ChatRequest):
+    """
+    Process text message and stream the spoken AI response as MP3 audio.
+    Each sentence is synthesized as soon as the agent finishes writing it, so
+    playback can start before the full response exists. The final answer is
+    added to the conversation history once the stream completes.
+    The first sentence is written before the response starts, so agent errors
+    still return a 500 instead of an empty 200.
+    """
+    sentences = stream_sentences(request.text, trade_context)
+    sentence_iter = iter(sentences)
+    try:
+        first_sentence = await run_in_threadpool(next, sentence_iter, None)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error processing chat: {str(e)}")
+
+    record_message("user", request.text)
+
+    def audio_chunks():
+        started = [first_sentence] if first_sentence is not None else []
+        try:
+            for sentence in itertools.chain(started, sentence_iter):
+                try:
+                    yield from api_service.stream_text_to_speech(sentence.strip())
+                except Exception as e:
+                    print(f"Error generating audio: {e}")
+        except Exception as e:
+            # The 200 is already sent; the audio simply ends early
+            print(f"Error processing chat: {e}")
+            return
+
+        record_message("assistant", sentences.final_text)
+
+    _, media_type = audio_format_info(TTS_OUTPUT_FORMAT)
+    return StreamingResponse(audio_chunks(), media_type=media_type)
+
 @app.post("/api/speech-to-text", response_model=SpeechToTextResponse)
 async def speech_to_text_endpoint(audio: UploadFile = File(...)):
     """
     Convert audio to text using ElevenLabs API.
     """
     try:
-        # Read audio file
-        audio_bytes = await audio.read()
-        
-        # Validate audio file
-        api_service.validate_audio_file(audio_bytes)
+        # Read and validate audio file
+        audio_bytes = await read_audio_upload(audio)
         
         # Process audio to text
-        transcribed_text = api_service.process_audio_to_text(audio_bytes)
+        transcribed_text = await run_in_threadpool(api_service.process_audio_to_text, audio_bytes)
         
         return SpeechToTextResponse(text=transcribed_text)
         
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error in speech-to-text: {str(e)}")
 
@@ -137,85 +245,87 @@ async def speech_to_text_endpoint(audio: UploadFile = File(...)):
 async def text_to_speech_endpoint(request: TextToSpeechRequest):
     """
     Convert text to speech using ElevenLabs API.
+    Audio is relayed chunk by chunk as ElevenLabs produces it, so playback can
+    start before synthesis finishes. Pass output_format="opus_48000_32" for a
+    smaller Ogg Opus stream where the client can play it.
     """
+    extension, media_type = audio_format_info(request.output_format)
+    
     try:
-        # Generate audio
-        audio_bytes = api_service.process_text_to_speech(request.text)
+        # Wait for the first chunk off the event loop; the rest is streamed from the threadpool
+        audio_chunks = await run_in_threadpool(
+            api_service.stream_text_to_speech, request.text, request.output_format
+        )
         
-        # Return as streaming response
         return StreamingResponse(
-            io.BytesIO(audio_bytes),
-            media_type="audio/mpeg",
-            headers={"Content-Disposition": "attachment; filename=speech.mp3"}
+            audio_chunks,
+            media_type=media_type,
+            headers={"Content-Disposition": f"attachment; filename=speech.{extension}"}
         )
         
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error in text-to-speech: {str(e)}")
 
 @app.post("/api/audio-chat", response_model=ChatResponse)
-async def audio_chat_endpoint(audio: UploadFile = File(...)):
+async def audio_chat_endpoint(http_request: Request, audio: UploadFile = File(...)):
     """
     Process audio input and return AI response with audio.
     This combines speech-to-text and chat functionality.
     """
     try:
         # Read and validate audio file
-        audio_bytes = await audio.read()
-        api_service.validate_audio_file(audio_bytes)
+        audio_bytes = await read_audio_upload(audio)
         
         # Convert audio to text
-        transcribed_text = api_service.process_audio_to_text(audio_bytes)
+        transcribed_text = await run_in_threadpool(api_service.process_audio_to_text, audio_bytes)
         
         # Add user message to history
-        user_message = {
-            "role": "user",
-            "content": transcribed_text,
-            "timestamp": datetime.now().isoformat()
-        }
-        conversation_history.append(user_message)
+        record_message("user", transcribed_text)
         
         # Process with AI agent
-        response_text = process_user_input(transcribed_text)
+        response_text = await run_in_threadpool(process_user_input, transcribed_text, trade_context)
         
         # Add assistant message to history
-        assistant_message = {
-            "role": "assistant",
-            "content": response_text,
-            "timestamp": datetime.now().isoformat()
-        }
-        conversation_history.append(assistant_message)
+        record_message("assistant", response_text)
         
         # Generate audio response
-        audio_url = None
-        try:
-            audio_bytes = api_service.process_text_to_speech(response_text)
-            audio_url = api_service.create_audio_data_url(audio_bytes)
-        except Exception as e:
-            print(f"Error generating audio: {e}")
+        audio_url = await speech_url(http_request, response_text)
         
         return ChatResponse(
             text=response_text,
             audio_url=audio_url
         )
         
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error processing audio chat: {str(e)}")
 
+@app.get("/api/audio/{audio_id}", name="get_audio")
+async def get_audio(audio_id: str):
+    """
+    Serve synthesized speech linked from a chat response's audio_url.
+    """
+    audio_path = api_service.cached_audio_path(audio_id)
+    if audio_path is None:
+        raise HTTPException(status_code=404, detail="Audio not found")
+    
+    media_type = next(
+        (media for extension, media in AUDIO_FORMATS.values() if extension == audio_path.suffix[1:]),
+        "application/octet-stream"
+    )
+    return FileResponse(audio_path, media_type=media_type)
+
 @app.get("/api/conversation-history", response_model=ConversationHistoryResponse)
 async def get_conversation_history():
     """
     Get conversation history.
     """
     try:
-        messages = []
-        for msg in conversation_history:
-            messages.append(Message(
-                role=msg["role"],
-                content=msg["content"],
-                timestamp=msg.get("timestamp")
-            ))
-        
-        return ConversationHistoryResponse(messages=messages)
+        # Messages are stored as Message models, so no per-request conversion is needed
+        return ConversationHistoryResponse(messages=list(conversation_history))
         
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error getting conversation history: {str(e)}")
@@ -227,6 +337,7 @@ async def clear_conversation_history():
     """
     try:
         conversation_history.clear()
+        trade_context.clear()
         return {"message": "Conversation history cleared"}
         
     except Exception as e:
@@ -268,9 +379,11 @@ async def status_endpoint():
         },
         "endpoints": {
             "chat": "/api/chat",
+            "chat_stream": "/api/chat-stream",
             "speech_to_text": "/api/speech-to-text",
             "text_to_speech": "/api/text-to-speech",
             "audio_chat": "/api/audio-chat",
+            "audio": "/api/audio/{audio_id}",
             "conversation_history": "/api/conversation-history",
             "health": "/api/health"
         }
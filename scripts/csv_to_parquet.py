@@ -0,0 +1,37 @@
+#!/usr/bin/env python3
+"""
+One-shot conversion of the WRDS swap rates CSV to zstd-compressed Parquet.
+tools.load_rates() prefers the Parquet copy whenever it is newer than the CSV,
+and rebuilds it on its own when it is stale; run this to prebuild it at deploy time.
+"""
+
+import os
+import sys
+import pyarrow as pa
+import pyarrow.csv as pv
+import pyarrow.parquet as pq
+
+CSV_PATH = "./data/wrds_swap_data.csv"
+PARQUET_PATH = "./data/wrds_swap_data.parquet"
+# Same column types as tools.RATES_DTYPES: ISO date strings, categorical labels
+CATEGORY = pa.dictionary(pa.int32(), pa.string())
+COLUMN_TYPES = {"date": pa.string(), "currency": CATEGORY, "tenor": CATEGORY, "rate": pa.float64()}
+
+def main():
+    """Convert the CSV given on the command line (or the default) to Parquet."""
+    src = sys.argv[1] if len(sys.argv) > 1 else CSV_PATH
+    dst = sys.argv[2] if len(sys.argv) > 2 else PARQUET_PATH
+
+    if not os.path.exists(src):
+        print(f"❌ {src} not found.")
+        sys.exit(1)
+
+    table = pv.read_csv(src, convert_options=pv.ConvertOptions(
+        column_types=COLUMN_TYPES,
+        include_columns=list(COLUMN_TYPES)
+    ))
+    pq.write_table(table, dst, compression="zstd", row_group_size=100_000)
+    print(f"✅ Wrote {table.num_rows} rows to {dst}")
+
+if __name__ == "__main__":
+    main()
@@ -47,12 +47,24 @@ def main():
     print("⏹️  Press Ctrl+C to stop the server")
     print("-" * 50)
     
+    # Conversation history and trade context live in process memory, so extra
+    # workers each get their own copy. Only raise WORKERS once that is acceptable.
+    workers = int(os.getenv("WORKERS", 1))
+    reload = os.getenv("ENV") == "dev"
+    if reload and workers > 1:
+        print("⚠️  ENV=dev enables auto-reload, which runs a single worker")
+    
     try:
         uvicorn.run(
             "main:app",
             host="0.0.0.0",
             port=8000,
-            reload=True,
+            workers=workers,
+            reload=reload,
+            # "auto" picks uvloop and httptools when installed, else asyncio and h11
+            loop="auto",
+            http="auto",
+            proxy_headers=True,
             log_level="info"
         )
     except KeyboardInterrupt:
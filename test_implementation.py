@@ -4,6 +4,11 @@ Test script for the upgraded Synapse Trader backend.
 Demonstrates the new data-driven pricing and strategic tools.
 """
 
+from contextlib import contextmanager
+from types import SimpleNamespace
+from unittest import mock
+
+import agent
 from tools import get_market_data, get_desk_axe, check_credit_limit, record_trade_and_notify
 
 def test_market_data():
@@ -23,27 +28,59 @@ def test_desk_axe():
 def test_credit_limit():
     """Test the renamed credit limit function."""
     print("=== Testing Credit Limit ===")
-    trade_details = {
-        "ccy_pair": "USDGBP",
-        "notional": 25000000,
-        "tenor": "3M"
-    }
-    result = check_credit_limit(trade_details)
+    result = check_credit_limit("ClientCorp", 25000000)
     print(f"Credit Limit Result: {result}")
     print()
 
 def test_audit_logging():
     """Test the renamed audit logging function."""
     print("=== Testing Audit Logging ===")
-    record_trade_and_notify(
-        "trade_execution",
-        {
-            "ccy_pair": "USDGBP",
-            "notional": 25000000,
-            "price": 1.26918,
-            "timestamp": "2025-08-02T12:00:00"
-        }
-    )
+    result = record_trade_and_notify("ClientCorp", 25000000, 1.26918, "USDGBP", "3M", "buy")
+    print(f"Trade Record Result: {result}")
+    print()
+
+def _stub_message(stop_reason, *blocks):
+    """Builds a Claude response message from content blocks."""
+    return SimpleNamespace(role="assistant", stop_reason=stop_reason, content=list(blocks))
+
+def _text_block(text):
+    """Builds a text content block."""
+    return SimpleNamespace(type="text", text=text)
+
+class _StubClaude:
+    """
+    Answers a pricing request with narration plus a tool call, then streams
+    the final quote, as Claude does in a tool-use turn.
+    """
+
+    def __init__(self):
+        self.messages = self
+
+    def create(self, **params):
+        return _stub_message(
+            "tool_use",
+            _text_block("Let me run the checks."),
+            SimpleNamespace(type="tool_use", id="toolu_1", name="get_desk_axe", input={"ccy_pair": "USDGBP"})
+        )
+
+    @contextmanager
+    def stream(self, **params):
+        deltas = ["The mid is 1.27136. ", "I quote 1.2710."]
+        yield SimpleNamespace(
+            text_stream=iter(deltas),
+            get_final_message=lambda: _stub_message("end_turn", _text_block("".join(deltas)))
+        )
+
+def test_stream_sentences():
+    """Test that streamed messages split into sentences and only the final one is kept."""
+    print("=== Testing Streamed Sentences ===")
+    with mock.patch.object(agent, "get_anthropic_client", return_value=_StubClaude()):
+        stream = agent.stream_sentences("Quote me 25 million USDGBP 3M for ClientCorp")
+        sentences = list(stream)
+    print(f"Sentences: {sentences}")
+    print(f"Final Text: {stream.final_text}")
+    assert [sentence.strip() for sentence in sentences] == ["Let me run the checks.", "The mid is 1.27136.", "I quote 1.2710."]
+    assert stream.final_text == "The mid is 1.27136. I quote 1.2710."
     print()
 
 def main():
@@ -56,6 +93,7 @@ def main():
     test_desk_axe()
     test_credit_limit()
     test_audit_logging()
+    test_stream_sentences()
     
     print("All tests completed successfully!")
     print("\nBackend upgrade summary:")
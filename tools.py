@@ -4,23 +4,275 @@ Provides functions for market data access, risk assessment, and audit logging.
 """
 
 import time
+import math
+import numpy as np
 import pandas as pd
-from datetime import datetime
-import json
+import orjson
 import os
-from typing import Any
-from elevenlabs.client import ElevenLabs
+import tempfile
+import atexit
+import functools
+import threading
+import queue
+import concurrent.futures
+import logging
+import logging.handlers
+from types import MappingProxyType
+from typing import NamedTuple
+from clients import get_eleven_client
 
-# Initialize ElevenLabs client
-eleven_client = ElevenLabs(api_key=os.getenv("ELEVENLABS_API_KEY"))
+logger = logging.getLogger(__name__)
 
-# Load the WRDS data at module level
 try:
-    df_rates = pd.read_csv("./data/wrds_swap_data.csv")
-except Exception as e:
-    print(f"Error loading WRDS data: {str(e)}")
-    df_rates = pd.DataFrame()
+    from numba import vectorize
+except ImportError:  # numba is optional; array pricing falls back to plain numpy
+    vectorize = None
 
+RATES_PATH = "./data/wrds_swap_data.csv"
+# Columnar snapshot of RATES_PATH, rewritten whenever the CSV is newer
+RATES_PARQUET_PATH = "./data/wrds_swap_data.parquet"
+# Declared up front so the CSV reader skips type inference. Dates stay ISO strings,
+# which compare in date order.
+RATES_DTYPES = {"date": "str", "currency": "category", "tenor": "category", "rate": "float64"}
+
+class RatesSnapshot(NamedTuple):
+    """A parsed WRDS file plus the lookups derived from it at load time."""
+    frame: pd.DataFrame
+    latest_rates: dict[str, float]
+
+_EMPTY_RATES = RatesSnapshot(pd.DataFrame(), {})
+
+@functools.lru_cache(maxsize=1)
+def _read_rates(path: str, mtime: float) -> RatesSnapshot:
+    """
+    Parses the WRDS file once per (path, mtime) pair.
+    The default CSV is read from its Parquet snapshot when that is fresh, and
+    the snapshot is rebuilt when it is not. Either way the cache key stays the
+    CSV's, so writing the snapshot never causes a second parse.
+    Also extracts each currency's rate on the latest date, so pricing calls
+    are dict lookups instead of column scans.
+    """
+    source = _rates_source(path)
+    try:
+        if source.endswith(".parquet"):
+            df = pd.read_parquet(source, engine="pyarrow")
+        else:
+            df = pd.read_csv(source, engine="pyarrow", usecols=list(RATES_DTYPES), dtype=RATES_DTYPES)
+    except Exception as e:
+        logger.error("Error loading WRDS data: %s", e)
+        return _EMPTY_RATES
+
+    if df.empty:
+        return RatesSnapshot(df, {})
+
+    # A handful of repeated labels: categoricals compare as integer codes and are
+    # stored dictionary-encoded in the Parquet snapshot
+    df = df.astype({column: "category" for column in ("currency", "tenor") if column in df.columns})
+
+    if source == RATES_PATH:
+        _write_rates_snapshot(df)
+
+    # First row per currency on the latest date, as the per-call masks used to pick
+    latest = df[df['date'] == df['date'].max()].drop_duplicates('currency')
+    # Plain str -> float, so quoting never touches a pandas or numpy scalar
+    latest_rates = dict(zip(latest['currency'].astype(str), latest['rate'].tolist()))
+    return RatesSnapshot(df, latest_rates)
+
+def _write_rates_snapshot(df: pd.DataFrame) -> None:
+    """
+    Saves the parsed CSV as Parquet so later loads, in this or any other process,
+    skip CSV parsing. Each writer uses its own temp file, replaced into place once
+    complete, so concurrent cache misses never collide and readers never see a
+    partial file.
+    """
+    tmp_path = None
+    try:
+        with tempfile.NamedTemporaryFile(
+            dir=os.path.dirname(RATES_PARQUET_PATH) or ".", suffix=".parquet.tmp", delete=False
+        ) as f:
+            tmp_path = f.name
+            df.to_parquet(f, engine="pyarrow", compression="zstd", index=False)
+        os.replace(tmp_path, RATES_PARQUET_PATH)
+    except Exception as e:
+        logger.error("Error writing WRDS snapshot: %s", e)
+        if tmp_path and os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+def _rates_source(path: str) -> str:
+    """Picks the Parquet copy of the rates file when it is at least as fresh as the CSV."""
+    if path != RATES_PATH or not os.path.exists(RATES_PARQUET_PATH):
+        return path
+    try:
+        if os.path.getmtime(RATES_PARQUET_PATH) >= os.path.getmtime(path):
+            return RATES_PARQUET_PATH
+    except OSError:
+        return RATES_PARQUET_PATH
+    return path
+
+def _load_rates(path: str) -> RatesSnapshot:
+    """Returns the cached snapshot for the current rates file on disk."""
+    try:
+        mtime = os.path.getmtime(path)
+    except OSError as e:
+        # A deployment may ship only the Parquet snapshot of the default CSV
+        if path == RATES_PATH and os.path.exists(RATES_PARQUET_PATH):
+            return _load_rates(RATES_PARQUET_PATH)
+        logger.error("Error loading WRDS data: %s", e)
+        return _EMPTY_RATES
+    return _read_rates(path, mtime)
+
+def load_rates(path: str = RATES_PATH) -> pd.DataFrame:
+    """
+    Returns the WRDS rates DataFrame, re-reading the file only when it changes on disk.
+    A fresh Parquet snapshot of the default CSV is read in its place.
+    """
+    return _load_rates(path).frame
+
+def load_latest_rates(path: str = RATES_PATH) -> dict[str, float]:
+    """Returns {currency: rate} on the latest date in the WRDS file, cached like load_rates."""
+    return _load_rates(path).latest_rates
+
+# Audit events go onto a queue. A writer thread drains it in batches, appending
+# each batch to a rotating log file in one write, so the calling thread never does
+# file I/O. A batch closes at AUDIT_BATCH_SIZE events or AUDIT_FLUSH_INTERVAL
+# seconds after its first event, whichever comes first.
+AUDIT_LOG_PATH = os.getenv("AUDIT_LOG_PATH", "./logs/audit.log")
+AUDIT_LOG_MAX_BYTES = 10 * 1024 * 1024
+AUDIT_LOG_BACKUP_COUNT = 5
+AUDIT_BATCH_SIZE = 500
+AUDIT_FLUSH_INTERVAL = 0.1
+
+_AUDIT_STOP = object()
+_audit_queue: queue.Queue = queue.Queue()
+_audit_lock = threading.Lock()
+_audit_writer = None
+
+def _next_audit_batch() -> tuple[list[str], bool]:
+    """Blocks for the next event, then collects more until the batch is full or due."""
+    record = _audit_queue.get()
+    if record is _AUDIT_STOP:
+        return [], True
+
+    batch = [record]
+    deadline = time.monotonic() + AUDIT_FLUSH_INTERVAL
+    while len(batch) < AUDIT_BATCH_SIZE:
+        timeout = deadline - time.monotonic()
+        if timeout <= 0:
+            break
+        try:
+            record = _audit_queue.get(timeout=timeout)
+        except queue.Empty:
+            break
+        if record is _AUDIT_STOP:
+            return batch, True
+        batch.append(record)
+    return batch, False
+
+def _write_audit_batches(handler: logging.Handler) -> None:
+    """Writer thread body: appends each batch as one log record until told to stop."""
+    stopping = False
+    while not stopping:
+        batch, stopping = _next_audit_batch()
+        if batch:
+            # In a real application, this would be one executemany INSERT into the audit table.
+            handler.handle(logging.makeLogRecord({"msg": "\n".join(batch)}))
+    handler.close()
+
+def _ensure_audit_writer() -> None:
+    """Starts the audit writer thread on first use, so importing tools creates no files."""
+    global _audit_writer
+    with _audit_lock:
+        if _audit_writer is not None:
+            return
+
+        os.makedirs(os.path.dirname(AUDIT_LOG_PATH) or ".", exist_ok=True)
+        handler = logging.handlers.RotatingFileHandler(
+            AUDIT_LOG_PATH,
+            maxBytes=AUDIT_LOG_MAX_BYTES,
+            backupCount=AUDIT_LOG_BACKUP_COUNT,
+            encoding="utf-8"
+        )
+        handler.setFormatter(logging.Formatter("%(message)s"))
+        _audit_writer = threading.Thread(target=_write_audit_batches, args=(handler,), name="audit-writer", daemon=True)
+        _audit_writer.start()
+
+def _utc_iso(timestamp: float) -> str:
+    """Formats a time.time() value as a naive UTC ISO 8601 string without building a datetime."""
+    return time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(timestamp)) + f'.{int(timestamp % 1 * 1e6):06d}'
+
+def log_audit_event(event_type: str, details: dict) -> None:
+    """
+    Queue an audit event for the writer thread. Never blocks on I/O, and an audit
+    failure never propagates into the trading path.
+    The event is serialized immediately, so later changes to details are not recorded.
+    """
+    try:
+        # Unlocked check first: the writer only needs starting once per process
+        if _audit_writer is None:
+            _ensure_audit_writer()
+        # orjson encodes numpy values natively; anything else falls back to str
+        record = orjson.dumps({
+            "logged_at": _utc_iso(time.time()),
+            "event_type": event_type,
+            "details": details
+        }, option=orjson.OPT_SERIALIZE_NUMPY, default=str).decode()
+        _audit_queue.put_nowait(record)
+    except Exception as e:
+        logger.error("Error logging audit event %s: %s", event_type, e)
+
+def flush_audit_log() -> None:
+    """Write every queued audit event and close the log file. The next event reopens it."""
+    global _audit_writer
+    with _audit_lock:
+        if _audit_writer is None:
+            return
+        _audit_queue.put(_AUDIT_STOP)
+        _audit_writer.join()
+        _audit_writer = None
+
+# Events still queued when the interpreter exits are written out, not dropped
+atexit.register(flush_audit_log)
+
+# Static desk reference data. The lookups below are pure functions of their
+# arguments, so they are memoized; their results are shared and must not be mutated.
+# The tables are read-only views; the records inside stay plain dicts because
+# they are returned to the agent and serialized as tool results.
+# In a real application, this would be queried from a database.
+CLIENT_DATA = MappingProxyType({
+    'ClientCorp': {
+        "risk_tolerance": "moderate",
+        "investment_horizon": "medium-term",
+        "portfolio_value": 1000000,
+        "preferred_assets": ("equities", "fixed_income")
+    },
+    'MegaFund': {
+        "risk_tolerance": "high",
+        "investment_horizon": "long-term",
+        "portfolio_value": 50000000,
+        "preferred_assets": ("equities", "derivatives")
+    },
+    'GlobalInvest': {
+        "risk_tolerance": "low",
+        "investment_horizon": "short-term",
+        "portfolio_value": 5000000,
+        "preferred_assets": ("fixed_income", "cash")
+    }
+})
+UNKNOWN_CLIENT = {
+    "risk_tolerance": "unknown",
+    "investment_horizon": "unknown",
+    "portfolio_value": 0,
+    "preferred_assets": ()
+}
+CREDIT_LIMITS = MappingProxyType({
+    'ClientCorp': 50_000_000.0,
+    'MegaFund': 200_000_000.0,
+    'GlobalInvest': 100_000_000.0
+})
+DESK_STRATEGY = MappingProxyType({"USDGBP": {"direction": "BUY", "currency": "GBP", "intensity": "HIGH"}})
+MAX_TRADE_NOTIONAL = 75_000_000.0
+
+@functools.lru_cache(maxsize=256)
 def get_client_info(client_id: str = None) -> dict:
     """
     Retrieve client portfolio and preferences.
@@ -31,34 +283,80 @@ def get_client_info(client_id: str = None) -> dict:
     Returns:
         dict: Client information including portfolio and preferences
     """
-    # In a real application, this would query a database.
-    # For this example, we'll use a hardcoded dictionary.
-    client_data = {
-        'ClientCorp': {
-            "risk_tolerance": "moderate",
-            "investment_horizon": "medium-term",
-            "portfolio_value": 1000000,
-            "preferred_assets": ["equities", "fixed_income"]
-        },
-        'MegaFund': {
-            "risk_tolerance": "high",
-            "investment_horizon": "long-term",
-            "portfolio_value": 50000000,
-            "preferred_assets": ["equities", "derivatives"]
-        },
-        'GlobalInvest': {
-            "risk_tolerance": "low",
-            "investment_horizon": "short-term",
-            "portfolio_value": 5000000,
-            "preferred_assets": ["fixed_income", "cash"]
-        }
+    return CLIENT_DATA.get(client_id, UNKNOWN_CLIENT)
+
+def _irp(spot, gbp_rate, usd_rate, days):
+    """Interest Rate Parity forward, with GBP accruing on ACT/365 and USD on ACT/360."""
+    return spot * (1 + gbp_rate * (days / 365)) / (1 + usd_rate * (days / 360))
+
+# With numba, array pricing runs as a compiled ufunc: one fused pass per element
+# instead of a temporary array per operator. The signature is given, so it
+# compiles (or loads the on-disk cache) at import rather than on the first quote.
+if vectorize is not None:
+    _irp_ufunc = vectorize(["float64(float64, float64, float64, float64)"], cache=True, fastmath=True)(_irp)
+else:
+    _irp_ufunc = _irp
+
+def compute_forwards(spot, gbp_rates, usd_rates, days) -> np.ndarray:
+    """
+    Interest Rate Parity forward prices, evaluated elementwise over numpy arrays.
+    GBP rates accrue on ACT/365 and USD rates on ACT/360. Scalars broadcast, so one
+    call prices a whole history of rate snapshots or a strip of tenors.
+    """
+    return _irp_ufunc(
+        np.asarray(spot, dtype=np.float64),
+        np.asarray(gbp_rates, dtype=np.float64),
+        np.asarray(usd_rates, dtype=np.float64),
+        np.asarray(days, dtype=np.float64)
+    )
+
+# Indicative USD/GBP spot used for every quote
+SPOT_RATE = 1.2725
+
+# get_market_data always quotes the 3M tenor, so its accrual fractions are fixed
+QUOTE_DAYS = 90
+_TAU_GBP = QUOTE_DAYS / 365
+_TAU_USD = QUOTE_DAYS / 360
+
+def price_fx_forward_batch(ccy_pair: str = "USDGBP", tenor_days=(90,)) -> dict:
+    """
+    Price FX forwards for many tenors at once from the latest WRDS rates.
+    The rates are looked up once and every tenor is priced in a single
+    vectorized call, so pricing sweeps and tenor ladders need no Python loop.
+    
+    Args:
+        ccy_pair: Currency pair to price
+        tenor_days: Tenors in days, any array-like
+        
+    Returns:
+        dict: all_in_price and forward_points as arrays aligned with tenor_days
+    """
+    rates = _load_rates(RATES_PATH)
+    # The derived dict is empty exactly when the frame is, and costs no pandas call to test
+    if not rates.latest_rates:
+        raise ValueError("WRDS data DataFrame is empty.")
+
+    usd_rate = _latest_rate(rates.latest_rates, 'USD')
+    gbp_rate = _latest_rate(rates.latest_rates, 'GBP')
+
+    tenor_days = np.asarray(tenor_days, dtype=np.float64)
+    all_in_price = np.round(compute_forwards(SPOT_RATE, gbp_rate, usd_rate, tenor_days), 5)
+    return {
+        "ccy_pair": ccy_pair,
+        "tenor_days": tenor_days,
+        "all_in_price": all_in_price,
+        "forward_points": np.round((all_in_price - SPOT_RATE) * 10000, 1),
+        "spot_rate": SPOT_RATE,
+        "usd_rate": usd_rate,
+        "gbp_rate": gbp_rate
     }
-    return client_data.get(client_id, {
-        "risk_tolerance": "unknown",
-        "investment_horizon": "unknown",
-        "portfolio_value": 0,
-        "preferred_assets": []
-    })
+
+def _latest_rate(latest_rates: dict[str, float], currency: str) -> float:
+    """Looks up a currency's rate on the latest WRDS date."""
+    rate = latest_rates.get(currency)
+    if rate is None:
+        raise ValueError(f"No WRDS rates for {currency}.")
+    return rate
 
 def get_market_data(ccy_pair: str = "USDGBP", notional_usd: int = 25000000, tenor: str = "3M") -> dict:
     """
@@ -66,21 +364,22 @@ def get_market_data(ccy_pair: str = "USDGBP", notional_usd: int = 25000000, teno
     Data is fetched from the local wrds_swap_data.csv file.
     """
     try:
-        if df_rates.empty:
+        rates = _load_rates(RATES_PATH)
+        if not rates.latest_rates:
             raise ValueError("WRDS data DataFrame is empty.")
 
-        latest_date = df_rates['date'].max()
-        df_latest = df_rates[df_rates['date'] == latest_date]
-        
-        usd_rate_3m = df_latest[df_latest['currency'] == 'USD']['rate'].iloc[0]
-        gbp_rate_3m = df_latest[df_latest['currency'] == 'GBP']['rate'].iloc[0]
-        spot_rate = 1.2725 
+        usd_rate_3m = _latest_rate(rates.latest_rates, 'USD')
+        gbp_rate_3m = _latest_rate(rates.latest_rates, 'GBP')
+        spot_rate = SPOT_RATE
 
-        days = 90
-        all_in_price = spot_rate * (((1 + gbp_rate_3m * (days/365))) / (1 + usd_rate_3m * (days/360)))
-        all_in_price = round(all_in_price, 5)
+        # A single quote stays in plain Python floats; a ufunc call would only add dispatch.
+        # Same formula as _irp, with the 3M day-count fractions precomputed.
+        all_in_price = spot_rate * (1 + gbp_rate_3m * _TAU_GBP) / (1 + usd_rate_3m * _TAU_USD)
+        # Half-up rounding by scale-and-floor, cheaper than round(); floor rather than
+        # int() so negative forward points round the same way as positive ones
+        all_in_price = math.floor(all_in_price * 100000.0 + 0.5) / 100000.0
 
-        forward_points = round((all_in_price - spot_rate) * 10000, 1)
+        forward_points = math.floor((all_in_price - spot_rate) * 100000.0 + 0.5) / 10.0
 
         return { 
             "status": "success", 
@@ -92,45 +391,84 @@ def get_market_data(ccy_pair: str = "USDGBP", notional_usd: int = 25000000, teno
         }
         
     except Exception as e:
-        print(f"Error in market data calculation: {str(e)}")
+        logger.error("Error in market data calculation: %s", e)
         return {"status": "error", "message": str(e)}
 
+@functools.lru_cache(maxsize=256)
 def get_desk_axe(ccy_pair: str) -> dict:
     """Returns the trading desk's current strategy (axe) for a currency pair."""
-    strategy = { "USDGBP": {"direction": "BUY", "currency": "GBP", "intensity": "HIGH"} }
-    if ccy_pair in strategy:
-        return {"status": "success", "axe": strategy[ccy_pair]}
+    if ccy_pair in DESK_STRATEGY:
+        return {"status": "success", "axe": DESK_STRATEGY[ccy_pair]}
     else:
         return {"status": "success", "axe": {"direction": "NEUTRAL"}}
 
+# Success replies are shared, so the common in-limit path formats nothing
+_OK_CREDIT = {
+    client_id: {"status": "success", "message": f"Trade within limits for {client_id}."}
+    for client_id in CREDIT_LIMITS
+}
+
 def check_credit_limit(client_id: str, notional_usd: float) -> dict:
     """
     Checks if a trade for a given client is within their trading limits.
     """
-    limits = {
-        'ClientCorp': 50_000_000.0,
-        'MegaFund': 200_000_000.0,
-        'GlobalInvest': 100_000_000.0
-    }
-    client_limit = limits.get(client_id)
+    # Quantized to cents so the failure cache key space stays bounded
+    notional_usd = round(notional_usd, 2)
+    client_limit = CREDIT_LIMITS.get(client_id)
+    if client_limit is not None and notional_usd <= client_limit:
+        return _OK_CREDIT[client_id]
+    return _credit_failure(client_id, notional_usd)
+
+@functools.lru_cache(maxsize=1024)
+def _credit_failure(client_id: str, notional_usd: float) -> dict:
+    """Builds the reply for an unknown client or a notional over its credit limit."""
+    client_limit = CREDIT_LIMITS.get(client_id)
 
     if client_limit is None:
         return {"status": "failure", "message": f"Client '{client_id}' not found."}
 
-    if notional_usd > client_limit:
-        return {
-            "status": "failure", 
-            "message": f"Notional of {notional_usd:,.2f} exceeds limit of {client_limit:,.2f} for {client_id}."
-        }
+    return {
+        "status": "failure", 
+        "message": f"Notional of {notional_usd:,.2f} exceeds limit of {client_limit:,.2f} for {client_id}."
+    }
 
-    return {"status": "success", "message": f"Trade within limits for {client_id}."}
+# Trade confirmations are synthesized off the booking path
+_NOTIFY_POOL = concurrent.futures.ThreadPoolExecutor(max_workers=2, thread_name_prefix="trade-notify")
+
+def _write_trade_notification(transaction_id: str) -> None:
+    """
+    Streams the spoken trade confirmation to audio_outputs/<transaction_id>.mp3.
+    Chunks go to disk as they arrive, and the file is renamed into place only once complete.
+    """
+    path = f"audio_outputs/{transaction_id}.mp3"
+    try:
+        audio_stream = get_eleven_client().text_to_speech.stream(
+            text=f"Trade booked successfully. Transaction ID {transaction_id}.",
+            voice_id="Josh",
+            model_id="eleven_turbo_v2_5",
+            output_format="mp3_44100_64"
+        )
+        
+        os.makedirs("audio_outputs", exist_ok=True)
+        with open(f"{path}.part", "wb") as f:
+            for chunk in audio_stream:
+                f.write(chunk)
+        os.replace(f"{path}.part", path)
+        
+    except Exception as e:
+        logger.error("Error generating trade notification for %s: %s", transaction_id, e)
+        if os.path.exists(f"{path}.part"):
+            os.remove(f"{path}.part")
 
 def record_trade_and_notify(client_id: str, notional_usd: float, price: float, ccy_pair: str, tenor: str, side: str) -> dict:
     """
     Records the details of a completed trade locally and generates a voice notification.
     """
     try:
-        transaction_id = f"TXN-{int(time.time())}"
+        # One clock read stamps both the id and the booking time. Nanoseconds keep
+        # trades booked in the same second from sharing an id (and an audio file).
+        now_ns = time.time_ns()
+        transaction_id = f"TXN-{now_ns}"
         
         trade_data = {
             "tx_id": transaction_id,
@@ -140,41 +478,36 @@ def record_trade_and_notify(client_id: str, notional_usd: float, price: float, c
             "tenor": tenor,
             "price": price,
             "side": side,
-            "booked_at": datetime.utcnow().isoformat()
+            "booked_at": _utc_iso(now_ns / 1e9)
         }
         
-        # In a real application, this would write to a database or a file.
-        # For this example, we'll just log it to the console.
-        print(f"[TRADE RECORDED]: {json.dumps(trade_data)}")
+        log_audit_event("TRADE_RECORDED", trade_data)
+        logger.debug("Recorded trade %s for %s", transaction_id, client_id)
 
-        notification_text = f"Trade booked successfully. Transaction ID {transaction_id}."
-        audio = eleven_client.text_to_speech.convert(
-            text=notification_text,
-            voice_id="Josh",
-            model_id="eleven_multilingual_v2",
-            output_format="mp3_44100_128"
-        )
-        
-        os.makedirs("audio_outputs", exist_ok=True)
-        with open(f"audio_outputs/{transaction_id}.mp3", "wb") as f:
-            f.write(audio)
+        # The booking is done; the voice confirmation lands on disk later
+        _NOTIFY_POOL.submit(_write_trade_notification, transaction_id)
         
         return {"status": "success", "transaction_id": transaction_id}
             
     except Exception as e:
-        print(f"Error recording trade: {e}")
+        logger.error("Error recording trade: %s", e)
         return {"status": "error", "message": str(e)}
 
+_OK_RISK = {"status": "success", "message": "Trade is within desk risk limits."}
+
 def check_trading_risk(notional_usd: float) -> dict:
     """
     Checks if a trade is within the desk's internal trading risk limits.
     """
-    max_notional = 75_000_000.0
+    notional_usd = round(notional_usd, 2)
+    if notional_usd <= MAX_TRADE_NOTIONAL:
+        return _OK_RISK
+    return _risk_failure(notional_usd)
 
-    if notional_usd > max_notional:
-        return {
-            "status": "failure",
-            "message": f"Trade size of {notional_usd:,.2f} exceeds the desk's max trade limit of {max_notional:,.2f}."
-        }
-    
-    return {"status": "success", "message": "Trade is within desk risk limits."}
+@functools.lru_cache(maxsize=1024)
+def _risk_failure(notional_usd: float) -> dict:
+    """Builds the reply for a notional over the desk's max trade size."""
+    return {
+        "status": "failure",
+        "message": f"Trade size of {notional_usd:,.2f} exceeds the desk's max trade limit of {MAX_TRADE_NOTIONAL:,.2f}."
+    }